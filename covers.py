@@ -0,0 +1,241 @@
+import argparse
+import hashlib
+import os
+import tempfile
+import threading
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit, urlunsplit
+import pandas as pd
+from dotenv import load_dotenv
+from fastapi import Response
+from PIL import Image
+
+load_dotenv()
+
+# Cover proxy: fetch each Google Books cover once, keep resized variants in a bounded on-disk cache
+COVER_CACHE_DIR = os.getenv("COVER_CACHE_DIR", "cover_cache")
+COVER_CACHE_MAX_BYTES = int(os.getenv("COVER_CACHE_MAX_MB", "512")) * 1024 * 1024
+# Replaces scheme and host of upstream cover URLs, e.g. a local stand-in server in tests
+COVER_UPSTREAM_BASE = os.getenv("COVER_UPSTREAM_BASE")
+COVER_UPSTREAM_TIMEOUT = float(os.getenv("COVER_UPSTREAM_TIMEOUT", "10"))
+COVER_SIZES = {"small": 200, "medium": 400, "large": 800}
+PLACEHOLDER_COVER = "sample-cover.png"
+PLACEHOLDER_KEY = "placeholder"
+
+class CoverCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        # Rebuild the LRU order from disk, least recently used first
+        files = [entry for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith(".jpg")]
+        for entry in sorted(files, key=lambda e: e.stat().st_mtime):
+            self._entries[entry.name] = entry.stat().st_size
+            self._total += entry.stat().st_size
+
+    @staticmethod
+    def filename(key, size: str) -> str:
+        return f"{key}-{size}.jpg"
+
+    def get(self, key, size: str):
+        name = self.filename(key, size)
+        with self._lock:
+            if name not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._entries.pop(name, 0)
+            return None
+        return data
+
+    def contains(self, key, size: str) -> bool:
+        with self._lock:
+            return self.filename(key, size) in self._entries
+
+    def put(self, key, variants: dict):
+        for size, data in variants.items():
+            name = self.filename(key, size)
+            # Write to a temp file and rename so readers never see partial images
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, os.path.join(self.directory, name))
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            with self._lock:
+                self._total += len(data) - self._entries.pop(name, 0)
+                self._entries[name] = len(data)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                name, size = self._entries.popitem(last=False)
+                self._total -= size
+                self.evictions += 1
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "bytes": self._total,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+_cover_cache = None
+
+def get_cover_cache():
+    # Created on first use so importing this module never touches the filesystem
+    global _cover_cache
+    if _cover_cache is None:
+        _cover_cache = CoverCache(COVER_CACHE_DIR, COVER_CACHE_MAX_BYTES)
+    return _cover_cache
+
+def cover_cache_stats():
+    # Reports nothing until a cover has been requested, rather than creating the cache
+    return _cover_cache.stats() if _cover_cache is not None else {}
+
+def upstream_url(thumbnail: str) -> str:
+    # Fetch the largest variant once and resize locally
+    url = thumbnail + f"&fife=w{max(COVER_SIZES.values())}"
+    if COVER_UPSTREAM_BASE:
+        parts = urlsplit(url)
+        base = urlsplit(COVER_UPSTREAM_BASE)
+        url = urlunsplit((base.scheme, base.netloc, base.path.rstrip("/") + parts.path, parts.query, ""))
+    return url
+
+def fetch_cover(thumbnail: str) -> bytes:
+    request = urllib.request.Request(upstream_url(thumbnail), headers={"User-Agent": "book-recommender-covers"})
+    with urllib.request.urlopen(request, timeout=COVER_UPSTREAM_TIMEOUT) as response:
+        return response.read()
+
+def render_variants(image_bytes: bytes) -> dict:
+    image = Image.open(BytesIO(image_bytes)).convert("RGB")
+    variants = {}
+    for size, width in COVER_SIZES.items():
+        resized = image
+        if image.width > width:
+            resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        buffer = BytesIO()
+        resized.save(buffer, format="JPEG", quality=85, optimize=True, progressive=True)
+        variants[size] = buffer.getvalue()
+    return variants
+
+def placeholder_cover(size: str) -> bytes:
+    data = get_cover_cache().get(PLACEHOLDER_KEY, size)
+    if data is None:
+        with open(PLACEHOLDER_COVER, "rb") as f:
+            variants = render_variants(f.read())
+        get_cover_cache().put(PLACEHOLDER_KEY, variants)
+        data = variants[size]
+    return data
+
+_fetches_lock = threading.Lock()
+_fetches = {}
+
+def cache_cover(isbn13: int, thumbnail: str) -> dict:
+    # Concurrent misses for the same book share one upstream fetch and resize
+    with _fetches_lock:
+        future = _fetches.get(isbn13)
+        is_leader = future is None
+        if is_leader:
+            future = _fetches[isbn13] = Future()
+    if not is_leader:
+        return future.result()
+
+    try:
+        variants = render_variants(fetch_cover(thumbnail))
+        get_cover_cache().put(isbn13, variants)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(variants)
+        return variants
+    finally:
+        with _fetches_lock:
+            del _fetches[isbn13]
+
+def get_cover(isbn13: int, thumbnail, size: str):
+    # Returns the JPEG bytes and whether the placeholder was served instead of the real cover
+    data = get_cover_cache().get(isbn13, size)
+    if data is not None:
+        return data, False
+    if pd.isna(thumbnail):
+        return placeholder_cover(size), True
+    try:
+        return cache_cover(isbn13, thumbnail)[size], False
+    except Exception:
+        # Upstream and decode failures (bad images, decompression bombs) aren't cached,
+        # so the real cover is retried later
+        return placeholder_cover(size), True
+
+def cover_response(isbn13: int, thumbnail, size: str, if_none_match: str = None) -> Response:
+    data, is_placeholder = get_cover(isbn13, thumbnail, size)
+    headers = {
+        "ETag": '"' + hashlib.blake2b(data, digest_size=8).hexdigest() + '"',
+        # Placeholders are cached briefly so the real cover shows up once upstream recovers
+        "Cache-Control": "public, max-age=3600" if is_placeholder else "public, max-age=31536000, immutable",
+    }
+    if if_none_match == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+def prefetch(books: pd.DataFrame, workers: int = 8):
+    cache = get_cover_cache()
+    pending = [
+        (int(isbn13), thumbnail)
+        for isbn13, thumbnail in zip(books["isbn13"], books["thumbnail"])
+        if not pd.isna(thumbnail) and not all(cache.contains(int(isbn13), size) for size in COVER_SIZES)
+    ]
+    with_thumbnail = int(books["thumbnail"].notna().sum())
+    print(f"{with_thumbnail - len(pending)} covers already cached, fetching {len(pending)}")
+
+    def fetch_one(book):
+        # One bad cover must not stop the rest of the catalog
+        try:
+            cache_cover(*book)
+            return True
+        except Exception:
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        fetched = sum(executor.map(fetch_one, pending))
+    print(f"Fetched {fetched}, failed {len(pending) - fetched}; cache: {cache.stats()}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prefetch and resize catalog covers into the cover cache")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--limit", type=int, help="only prefetch the first N books")
+    args = parser.parse_args()
+
+    catalog = pd.read_csv("books_with_emotions.csv", usecols=["isbn13", "thumbnail"]).drop_duplicates("isbn13")
+    if args.limit:
+        catalog = catalog.head(args.limit)
+    prefetch(catalog, workers=args.workers)
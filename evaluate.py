@@ -0,0 +1,136 @@
+import argparse
+import itertools
+import re
+import time
+import numpy as np
+import pandas as pd
+
+from main import get_books, get_db, order_by_tone, rank_candidates, TONE_COLUMNS
+
+# Offline evaluation of retrieval settings: recall@k, MRR and latency per configuration.
+#
+#   python evaluate.py --queries 200 --k 16 --initial-top-k 16,32,50,100
+
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+DOMINANT_TONE = {column: tone for tone, column in TONE_COLUMNS.items()}
+
+# How a configuration picks category/tone: "All" (off), "noisy" (what a user looking for the
+# answer would pick: its own label, but a different one with probability --label-noise) or
+# "oracle" (always the answer's own label, an upper bound that leaks the target)
+FILTER_MODES = ["All", "noisy", "oracle"]
+
+def noisy_label(rng, label: str, labels: list, noise: float) -> str:
+    others = [other for other in labels if other != label]
+    if others and rng.random() < noise:
+        return others[rng.integers(len(others))]
+    return label
+
+def build_queries(books: pd.DataFrame, n: int, seed: int, noise: float, min_words: int = 8) -> pd.DataFrame:
+    # Held-out queries: one description sentence per sampled book, with that book as the answer
+    rng = np.random.default_rng(seed)
+    categories = sorted(books["simple_categories"].unique())
+    tones = list(TONE_COLUMNS)
+    rows = []
+    for idx in rng.permutation(len(books)):
+        book = books.iloc[idx]
+        sentences = [s for s in SENTENCE_SPLIT.split(str(book["description"])) if len(s.split()) >= min_words]
+        if not sentences:
+            continue
+        emotions = book[list(DOMINANT_TONE)].astype(float)
+        category = book["simple_categories"]
+        tone = DOMINANT_TONE[emotions.idxmax()]
+        rows.append({
+            "query": sentences[rng.integers(len(sentences))],
+            "isbn13": int(book["isbn13"]),
+            "oracle_category": category,
+            "oracle_tone": tone,
+            "noisy_category": noisy_label(rng, category, categories, noise),
+            "noisy_tone": noisy_label(rng, tone, tones, noise),
+        })
+        if len(rows) == n:
+            break
+    return pd.DataFrame(rows)
+
+def pick(query, field: str, mode: str) -> str:
+    return "All" if mode == "All" else getattr(query, f"{mode}_{field}")
+
+def evaluate_config(queries: pd.DataFrame, k: int, initial_top_k: int, category_mode: str, tone_mode: str) -> dict:
+    hits, reciprocal_ranks, latencies = [], [], []
+    for q in queries.itertuples(index=False):
+        start = time.perf_counter()
+        isbns, _ = rank_candidates(
+            q.query,
+            category=pick(q, "category", category_mode),
+            initial_top_k=initial_top_k,
+        )
+        page = order_by_tone(isbns[:k], pick(q, "tone", tone_mode))
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        positions = np.flatnonzero(page == q.isbn13)
+        hits.append(len(positions) > 0)
+        reciprocal_ranks.append(1.0 / (positions[0] + 1) if len(positions) else 0.0)
+
+    return {
+        "initial_top_k": initial_top_k,
+        "category": category_mode,
+        "tone": tone_mode,
+        "oracle": "oracle" in (category_mode, tone_mode),
+        f"recall@{k}": float(np.mean(hits)),
+        "mrr": float(np.mean(reciprocal_ranks)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+def pareto_front(results: pd.DataFrame, quality: str, cost: str = "p50_ms") -> pd.Series:
+    # A configuration is on the front if no other one is at least as good on both axes and better on one
+    on_front = []
+    for _, row in results.iterrows():
+        dominated = (
+            (results[quality] >= row[quality]) & (results[cost] <= row[cost])
+            & ((results[quality] > row[quality]) | (results[cost] < row[cost]))
+        ).any()
+        on_front.append(not dominated)
+    return pd.Series(on_front, index=results.index)
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate recall/latency trade-offs of retrieval settings")
+    parser.add_argument("--queries", type=int, default=200, help="number of held-out queries")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--k", type=int, default=16, help="cut-off for recall@k and MRR (final_top_k)")
+    parser.add_argument("--initial-top-k", default="16,32,50,100", help="comma-separated values to compare")
+    parser.add_argument("--label-noise", type=float, default=0.2,
+                        help="chance that a noisy category/tone differs from the answer's own label")
+    parser.add_argument("--csv", help="also write the results table to this path")
+    args = parser.parse_args()
+
+    initial_top_ks = [int(v) for v in args.initial_top_k.split(",")]
+    queries = build_queries(get_books(), args.queries, args.seed, args.label_noise)
+
+    # Warm up the model and index so the first configuration isn't charged for loading
+    get_db()
+    rank_candidates(queries["query"].iloc[0], initial_top_k=max(initial_top_ks))
+
+    results = pd.DataFrame([
+        evaluate_config(queries, args.k, initial_top_k, category_mode, tone_mode)
+        for initial_top_k, category_mode, tone_mode in itertools.product(initial_top_ks, FILTER_MODES, FILTER_MODES)
+    ])
+    # Fronts on recall (category filter, initial_top_k) and on MRR (which also reflects tone
+    # ordering). Oracle rows use the answer's labels, so they're kept out of both
+    realistic = ~results["oracle"]
+    pareto_columns = {"pareto_recall": f"recall@{args.k}", "pareto_mrr": "mrr"}
+    for column, quality in pareto_columns.items():
+        results[column] = False
+        results.loc[realistic, column] = pareto_front(results[realistic], quality=quality)
+    results = results.sort_values("p50_ms").reset_index(drop=True)
+
+    float_format = lambda v: f"{v:.3f}"
+    print(f"{len(queries)} queries, seed {args.seed}, label noise {args.label_noise}")
+    print(results[~results["oracle"]].drop(columns="oracle").to_string(index=False, float_format=float_format))
+    print()
+    print("Oracle upper bounds (category/tone taken from the answer book; not for choosing settings):")
+    print(results[results["oracle"]].drop(columns=["oracle", *pareto_columns]).to_string(index=False, float_format=float_format))
+    if args.csv:
+        results.to_csv(args.csv, index=False)
+
+if __name__ == "__main__":
+    main()
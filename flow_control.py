@@ -0,0 +1,185 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import threading
+import time
+
+# Single-flight: concurrent identical requests share one in-progress retrieval
+class SingleFlight:
+    def __init__(self, executor=None):
+        self.executor = executor
+        self._inflight = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def run(self, key, fn, *args, **kwargs):
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+            self._inflight[key] = future
+            self.executed += 1
+            future.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.coalesced += 1
+        # Shield so one waiter disconnecting doesn't cancel the shared work
+        return await asyncio.shield(future)
+
+    def __contains__(self, key):
+        return key in self._inflight
+
+    def _finish(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        # Mark the exception as retrieved in case every waiter went away
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._inflight),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
+
+def client_ip(peer: str, forwarded_for: str, trusted_hops: int) -> str:
+    # Each trusted proxy appends the address it received the request from, so the caller is
+    # the entry `trusted_hops` from the right; anything further left is client-controlled
+    hops = [hop.strip() for hop in (forwarded_for or "").split(",") if hop.strip()]
+    if trusted_hops > 0 and len(hops) >= trusted_hops:
+        return hops[-trusted_hops]
+    return peer or "unknown"
+
+class RateLimiter:
+    def __init__(self, rate_per_minute: float, burst: int, max_clients: int = 10000):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = {}
+        self.limited = 0
+
+    def acquire(self, client_key: str) -> float:
+        # Returns 0 when the request may proceed, otherwise seconds until a token is available
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        tokens, last = self._buckets.get(client_key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            self._buckets[client_key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_clients:
+                self._prune(now)
+            return 0.0
+        self._buckets[client_key] = (tokens, now)
+        self.limited += 1
+        return (1 - tokens) / self.rate
+
+    def _prune(self, now: float):
+        # Buckets that have refilled completely are indistinguishable from new clients
+        for key, (tokens, last) in list(self._buckets.items()):
+            if tokens + (now - last) * self.rate >= self.burst:
+                del self._buckets[key]
+
+    def stats(self):
+        return {"clients": len(self._buckets), "limited": self.limited}
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("Service is overloaded, please retry later")
+        self.retry_after = retry_after
+
+# Admission control: at most `slots` retrievals run at once, the rest wait by priority
+class AdmissionController:
+    def __init__(self, slots: int, max_queue: int, deadline: float, initial_service_time: float = 1.0):
+        self.slots = slots
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._service_time = initial_service_time
+        self._displaced = set()
+        self.admitted = 0
+        self.shed = 0
+
+    def _estimated_wait(self, priority: int) -> float:
+        ahead = self._active + sum(1 for entry in self._waiting if entry[0] <= priority)
+        return max(0, ahead - self.slots + 1) * self._service_time / self.slots
+
+    def _queue_full(self) -> bool:
+        return len(self._waiting) >= self.max_queue
+
+    def _can_displace(self, priority: int) -> bool:
+        return bool(self._waiting) and max(self._waiting)[0] > priority
+
+    def _displace(self):
+        # A full queue makes room for higher-priority work by shedding its lowest-priority, newest entry
+        entry = max(self._waiting)
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+        self._displaced.add(entry)
+        self.shed += 1
+        self._cond.notify_all()
+
+    def _check(self, priority: int):
+        # Shed early rather than queue work that can't start before its deadline
+        estimated_wait = self._estimated_wait(priority)
+        if estimated_wait > self.deadline or (self._queue_full() and not self._can_displace(priority)):
+            self.shed += 1
+            raise Overloaded(retry_after=max(estimated_wait, self._service_time))
+
+    def enqueue(self, priority: int):
+        # Takes a place in the queue right away, before any worker thread picks the request up,
+        # so queue depth and shedding see every accepted request
+        with self._cond:
+            self._check(priority)
+            if self._queue_full():
+                self._displace()
+            entry = (priority, next(self._seq), time.monotonic() + self.deadline)
+            heapq.heappush(self._waiting, entry)
+            return entry
+
+    def run(self, priority: int, fn, *args, **kwargs):
+        return self.run_ticket(self.enqueue(priority), fn, *args, **kwargs)
+
+    def run_ticket(self, entry, fn, *args, **kwargs):
+        with self._cond:
+            expires_at = entry[2]
+            while True:
+                if entry in self._displaced:
+                    self._displaced.remove(entry)
+                    raise Overloaded(retry_after=self._service_time)
+                if self._active < self.slots and self._waiting[0] == entry:
+                    break
+                remaining = expires_at - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self.shed += 1
+                    self._cond.notify_all()
+                    raise Overloaded(retry_after=self._service_time)
+                self._cond.wait(remaining)
+            heapq.heappop(self._waiting)
+            self._active += 1
+            self.admitted += 1
+            self._cond.notify_all()
+
+        start = time.monotonic()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._service_time = 0.8 * self._service_time + 0.2 * (time.monotonic() - start)
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "active": self._active,
+                "queue_depth": len(self._waiting),
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "avg_service_seconds": round(self._service_time, 3),
+            }
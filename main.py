@@ -1,7 +1,8 @@
 import gradio as gr
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
 import uvicorn
@@ -15,6 +16,12 @@ from langchain.embeddings import HuggingFaceEmbeddings
 import time
 import os
 import gc
+import orjson
+import math
+from concurrent.futures import ThreadPoolExecutor
+import covers
+from flow_control import AdmissionController, Overloaded, RateLimiter, SingleFlight, client_ip
+from pagination import CandidateCache, load_cursor, paginate
 
 # Load environment variables
 load_dotenv()
@@ -35,8 +42,54 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# How long ranked candidate lists stay available for "load more" cursors
+CURSOR_TTL_SECONDS = int(os.getenv("CURSOR_TTL_SECONDS", "600"))
+CURSOR_CACHE_SIZE = int(os.getenv("CURSOR_CACHE_SIZE", "1024"))
+# Upper bound on initial_top_k, which also bounds the size of each cached ranking
+MAX_INITIAL_TOP_K = int(os.getenv("MAX_INITIAL_TOP_K", "200"))
+
+# Per-client token bucket for /api/recommend (keyed by X-API-Key, else client IP)
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "10"))
+# Number of reverse proxies in front of the app that append to X-Forwarded-For (1 on Render)
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+# Bounded priority queue in front of retrieval
+RETRIEVAL_SLOTS = int(os.getenv("RETRIEVAL_SLOTS", "2"))
+RETRIEVAL_QUEUE_SIZE = int(os.getenv("RETRIEVAL_QUEUE_SIZE", "16"))
+RETRIEVAL_QUEUE_DEADLINE_SECONDS = float(os.getenv("RETRIEVAL_QUEUE_DEADLINE_SECONDS", "10"))
+# One thread per running or queued retrieval, so waiting happens in the priority queue
+# and never in the executor's own unbounded FIFO
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_SLOTS + RETRIEVAL_QUEUE_SIZE,
+    thread_name_prefix="retrieval"
+)
+
+# Public base URL of this service; when set, results link covers through /covers
+COVER_PROXY_BASE = os.getenv("COVER_PROXY_BASE")
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+# Comma-separated API keys that get their own bucket; other keys are rejected. Keyed callers
+# are batch traffic unless the key is listed as "key:interactive"
+API_KEYS = {}
+for api_key_entry in os.getenv("API_KEYS", "").split(","):
+    api_key, _, key_class = api_key_entry.strip().partition(":")
+    if api_key:
+        API_KEYS[api_key] = PRIORITY_INTERACTIVE if key_class == "interactive" else PRIORITY_BATCH
+
+TONE_COLUMNS = {
+    "Happy": "joy",
+    "Surprising": "surprise",
+    "Angry": "anger",
+    "Suspenseful": "fear",
+    "Sad": "sadness",
+}
+
 # Global variables for lazy loading
 _books = None
+_books_by_isbn = None
 _db_books = None
 _embedding = None
 
@@ -54,8 +107,19 @@ def get_books():
             "sample-cover.png", 
             _books["large_thumbnail"]
         )
+        if COVER_PROXY_BASE:
+            _books["large_thumbnail"] = (
+                COVER_PROXY_BASE.rstrip("/") + "/covers/" + _books["isbn13"].astype(str) + "?size=medium"
+            )
     return _books
 
+def get_books_by_isbn():
+    global _books_by_isbn
+    if _books_by_isbn is None:
+        books = get_books()
+        _books_by_isbn = books.drop_duplicates("isbn13").set_index("isbn13", drop=False).rename_axis(None)
+    return _books_by_isbn
+
 def get_embedding():
     global _embedding
     if _embedding is None:
@@ -86,6 +150,19 @@ def get_db():
             )
     return _db_books
 
+recommend_flight = SingleFlight(executor=retrieval_executor)
+rate_limiter = RateLimiter(rate_per_minute=RATE_LIMIT_PER_MINUTE, burst=RATE_LIMIT_BURST)
+admission = AdmissionController(
+    slots=RETRIEVAL_SLOTS,
+    max_queue=RETRIEVAL_QUEUE_SIZE,
+    deadline=RETRIEVAL_QUEUE_DEADLINE_SECONDS
+)
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split())
+
+candidate_cache = CandidateCache(ttl=CURSOR_TTL_SECONDS, max_entries=CURSOR_CACHE_SIZE)
+
 # Pydantic models for request/response
 class RecommendationRequest(BaseModel):
     query: str
@@ -93,6 +170,9 @@ class RecommendationRequest(BaseModel):
     tone: Optional[str] = "All"
     initial_top_k: Optional[int] = 50
     final_top_k: Optional[int] = 16
+    cursor: Optional[str] = None
+    # Cut descriptions to 30 words, as the dashboard does
+    truncate_descriptions: Optional[bool] = False
 
 class BookRecommendation(BaseModel):
     title: str
@@ -104,6 +184,37 @@ class BookRecommendation(BaseModel):
 
 class RecommendationResponse(BaseModel):
     recommendations: List[BookRecommendation]
+    next_cursor: Optional[str] = None
+
+def rank_candidates(
+    query: str,
+    category: str = None,
+    initial_top_k: int = 50,
+):
+    db = get_db()
+    books = get_books_by_isbn()
+
+    recs = db.similarity_search_with_score(query, k=initial_top_k)
+    ranked = pd.DataFrame({
+        "isbn13": np.array([int(rec.page_content.strip('"').split()[0]) for rec, _ in recs], dtype=np.int64),
+        "score": np.array([score for _, score in recs], dtype=np.float32),
+    }).drop_duplicates("isbn13")
+    ranked = ranked[ranked["isbn13"].isin(books.index)]
+
+    if category not in (None, "All"):
+        ranked = ranked[books.loc[ranked["isbn13"], "simple_categories"].to_numpy() == category]
+
+    return ranked["isbn13"].to_numpy(), ranked["score"].to_numpy()
+
+def order_by_tone(isbns: np.ndarray, tone: str = None) -> np.ndarray:
+    # Tone re-orders the books on a page; it doesn't change which books make the page
+    if tone not in TONE_COLUMNS:
+        return isbns
+    tone_scores = get_books_by_isbn().loc[isbns, TONE_COLUMNS[tone]].to_numpy()
+    return isbns[np.argsort(-tone_scores, kind="stable")]
+
+def books_for_isbns(isbns: np.ndarray) -> pd.DataFrame:
+    return get_books_by_isbn().loc[isbns]
 
 def retrieve_semantic_recommendations(
     query: str,
@@ -111,46 +222,70 @@ def retrieve_semantic_recommendations(
     tone: str = None,
     initial_top_k: int = 50,
     final_top_k: int = 16,
+    priority: int = PRIORITY_INTERACTIVE,
 ) -> pd.DataFrame:
     # Add artificial delay for loading animation
     time.sleep(0.5)
-    
-    db = get_db()
-    books = get_books()
-    
-    recs = db.similarity_search(query, k=initial_top_k)
-    books_list = [int(rec.page_content.strip('"').split()[0]) for rec in recs]
-    book_recs = books[books["isbn13"].isin(books_list)].head(final_top_k)
-
-    if category != "All":
-        book_recs = book_recs[book_recs["simple_categories"] == category][:final_top_k]
-    else:
-        book_recs = book_recs.head(final_top_k)
-
-    if tone == "Happy":
-        book_recs.sort_values(by='joy', ascending=False, inplace=True)
-    elif tone == "Surprising":
-        book_recs.sort_values(by='surprise', ascending=False, inplace=True)
-    elif tone == "Angry":
-        book_recs.sort_values(by='anger', ascending=False, inplace=True)
-    elif tone == "Suspenseful":
-        book_recs.sort_values(by='fear', ascending=False, inplace=True)
-    elif tone == "Sad":
-        book_recs.sort_values(by='sadness', ascending=False, inplace=True)
-
-    return book_recs
+
+    isbns, _ = admission.run(
+        priority,
+        rank_candidates,
+        query,
+        category=category,
+        initial_top_k=initial_top_k
+    )
+    return books_for_isbns(order_by_tone(isbns[:final_top_k], tone))
+
+def truncate_description(description: str, max_words: int = 30) -> str:
+    return " ".join(description.split()[:max_words]) + "..."
+
+def serialize_recommendations(book_recs: pd.DataFrame, truncate: bool = False, next_cursor: str = None) -> bytes:
+    # Build the response straight from column arrays; matches RecommendationResponse
+    descriptions = book_recs["description"].tolist()
+    if truncate:
+        descriptions = [truncate_description(d) for d in descriptions]
+    recommendations = [
+        {
+            "title": title,
+            "authors": authors,
+            "description": description,
+            "thumbnail": thumbnail,
+            "category": category,
+            "emotions": {
+                "joy": joy,
+                "surprise": surprise,
+                "anger": anger,
+                "fear": fear,
+                "sadness": sadness
+            }
+        }
+        for title, authors, description, thumbnail, category, joy, surprise, anger, fear, sadness in zip(
+            book_recs["title"].tolist(),
+            book_recs["authors"].tolist(),
+            descriptions,
+            book_recs["large_thumbnail"].tolist(),
+            book_recs["simple_categories"].tolist(),
+            book_recs["joy"].astype(float).tolist(),
+            book_recs["surprise"].astype(float).tolist(),
+            book_recs["anger"].astype(float).tolist(),
+            book_recs["fear"].astype(float).tolist(),
+            book_recs["sadness"].astype(float).tolist()
+        )
+    ]
+    return orjson.dumps({"recommendations": recommendations, "next_cursor": next_cursor})
 
 def recommend_books(query: str, category: str, tone: str):
     if not query.strip():
         return []
         
-    recommendations = retrieve_semantic_recommendations(query=query, category=category, tone=tone)
+    try:
+        recommendations = retrieve_semantic_recommendations(query=query, category=category, tone=tone)
+    except Overloaded:
+        raise gr.Error("The service is busy right now, please try again in a moment.")
     results = []
 
     for _, row in recommendations.iterrows():
-        description = row["description"]
-        truncated_desc_split = description.split()
-        truncated_description = " ".join(truncated_desc_split[:30]) + "..."
+        truncated_description = truncate_description(row["description"])
 
         authors_split = row["authors"].split(";")
 
@@ -184,7 +319,9 @@ async def root():
             "/docs": "API Documentation",
             "/api/recommend": "POST - Get book recommendations",
             "/api/categories": "GET - Get available categories",
-            "/api/tones": "GET - Get available emotional tones"
+            "/api/tones": "GET - Get available emotional tones",
+            "/api/metrics": "GET - Service counters for monitoring",
+            "/covers/{isbn13}": "GET - Cached, resized book cover (size=small|medium|large)"
         }
     }
 
@@ -199,40 +336,108 @@ async def get_tones():
     tones = ["All", "Happy", "Surprising", "Angry", "Suspenseful", "Sad"]
     return {"tones": tones}
 
+@app.get("/covers/{isbn13}")
+async def get_cover(isbn13: int, request: Request, size: str = "medium"):
+    if size not in covers.COVER_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {', '.join(covers.COVER_SIZES)}")
+    books = get_books_by_isbn()
+    if isbn13 not in books.index:
+        raise HTTPException(status_code=404, detail="Book not found")
+
+    return await run_in_threadpool(
+        covers.cover_response,
+        isbn13,
+        books.at[isbn13, "thumbnail"],
+        size,
+        request.headers.get("if-none-match")
+    )
+
+@app.get("/api/metrics")
+async def get_metrics():
+    return {
+        "recommend_single_flight": recommend_flight.stats(),
+        "recommend_cursor_cache": candidate_cache.stats(),
+        "recommend_rate_limit": rate_limiter.stats(),
+        "retrieval_admission": admission.stats(),
+        "cover_cache": covers.cover_cache_stats(),
+    }
+
 @app.post("/api/recommend", response_model=RecommendationResponse)
-async def get_recommendations(request: RecommendationRequest):
-    try:
-        if not request.query.strip():
-            raise HTTPException(status_code=400, detail="Query cannot be empty")
-
-        recommendations = retrieve_semantic_recommendations(
-            query=request.query,
-            category=request.category,
-            tone=request.tone,
-            initial_top_k=request.initial_top_k,
-            final_top_k=request.final_top_k
+async def get_recommendations(request: RecommendationRequest, raw_request: Request):
+    api_key = raw_request.headers.get("x-api-key")
+    if api_key is not None and api_key not in API_KEYS:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    client_key = api_key or client_ip(
+        raw_request.client.host if raw_request.client else None,
+        raw_request.headers.get("x-forwarded-for"),
+        TRUSTED_PROXY_HOPS
+    )
+    retry_after = rate_limiter.acquire(client_key)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(math.ceil(retry_after))}
         )
 
-        results = []
-        for _, row in recommendations.iterrows():
-            book = BookRecommendation(
-                title=row["title"],
-                authors=row["authors"],
-                description=row["description"],
-                thumbnail=row["large_thumbnail"],
-                category=row["simple_categories"],
-                emotions={
-                    "joy": float(row["joy"]),
-                    "surprise": float(row["surprise"]),
-                    "anger": float(row["anger"]),
-                    "fear": float(row["fear"]),
-                    "sadness": float(row["sadness"])
-                }
-            )
-            results.append(book)
+    # Priority comes from the API key; X-Priority: batch can only lower it
+    priority = API_KEYS[api_key] if api_key else PRIORITY_INTERACTIVE
+    if raw_request.headers.get("x-priority", "").lower() == "batch":
+        priority = PRIORITY_BATCH
+
+    try:
+        if not request.final_top_k or request.final_top_k < 1:
+            raise HTTPException(status_code=400, detail="final_top_k must be positive")
 
-        return RecommendationResponse(recommendations=results)
+        if request.cursor:
+            # Later pages slice the cached ranking; no embedding or search
+            isbns, scores, tone, token, offset = load_cursor(candidate_cache, request.cursor)
+        else:
+            query = normalize_query(request.query)
+            if not query:
+                raise HTTPException(status_code=400, detail="Query cannot be empty")
+            if not request.initial_top_k or not 1 <= request.initial_top_k <= MAX_INITIAL_TOP_K:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"initial_top_k must be between 1 and {MAX_INITIAL_TOP_K}"
+                )
+
+            # Priority is part of the key so interactive callers never wait behind a batch search
+            key = (query, request.category, request.initial_top_k, priority)
+            # Followers of an in-flight search share it and don't take a queue place
+            ticket = None if key in recommend_flight else admission.enqueue(priority)
+            isbns, scores = await recommend_flight.run(
+                key,
+                admission.run_ticket,
+                ticket,
+                rank_candidates,
+                query=query,
+                category=request.category,
+                initial_top_k=request.initial_top_k
+            )
+            tone = request.tone
+            token, offset = None, 0
+
+        page, next_cursor = paginate(candidate_cache, isbns, scores, tone, token, offset, request.final_top_k)
+
+        # Returning a Response skips response_model validation; the schema stays documented
+        return Response(
+            content=serialize_recommendations(
+                books_for_isbns(order_by_tone(page, tone)),
+                truncate=bool(request.truncate_descriptions),
+                next_cursor=next_cursor
+            ),
+            media_type="application/json"
+        )
 
+    except HTTPException:
+        raise
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
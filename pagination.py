@@ -0,0 +1,75 @@
+import base64
+import binascii
+import secrets
+import time
+from collections import OrderedDict
+import numpy as np
+from fastapi import HTTPException
+
+# Ranked candidate lists (ISBNs and scores) kept for cursor pagination
+class CandidateCache:
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def put(self, isbns: np.ndarray, scores: np.ndarray, tone: str = None) -> str:
+        self._evict_expired()
+        token = secrets.token_urlsafe(9)
+        self._entries[token] = (time.monotonic() + self.ttl, isbns, scores, tone)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return token
+
+    def get(self, token: str):
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        expires_at, isbns, scores, tone = entry
+        if expires_at < time.monotonic():
+            del self._entries[token]
+            return None
+        return isbns, scores, tone
+
+    def _evict_expired(self):
+        # Entries are inserted in expiry order, so the oldest expire first
+        now = time.monotonic()
+        while self._entries:
+            token, (expires_at, *_) = next(iter(self._entries.items()))
+            if expires_at >= now:
+                break
+            del self._entries[token]
+
+    def stats(self):
+        return {"entries": len(self._entries)}
+
+def encode_cursor(token: str, offset: int) -> str:
+    return base64.urlsafe_b64encode(f"{token}:{offset}".encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        token, offset = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit(":", 1)
+        offset = int(offset)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return token, offset
+
+def load_cursor(cache: CandidateCache, cursor: str):
+    token, offset = decode_cursor(cursor)
+    candidates = cache.get(token)
+    if candidates is None:
+        raise HTTPException(status_code=410, detail="Cursor expired")
+    isbns, scores, tone = candidates
+    return isbns, scores, tone, token, offset
+
+def paginate(cache: CandidateCache, isbns: np.ndarray, scores: np.ndarray, tone: str, token: str, offset: int, page_size: int):
+    # Returns the page's ISBNs and the cursor for the next page; the ranking is cached on first use
+    end = offset + page_size
+    next_cursor = None
+    if end < len(isbns):
+        if token is None:
+            token = cache.put(isbns, scores, tone)
+        next_cursor = encode_cursor(token, end)
+    return isbns[offset:end], next_cursor
@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+import pandas as pd
+import pytest
+from PIL import Image
+
+import covers
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THUMBNAIL = "http://books.google.com/books/content?id=abc&printsec=frontcover&img=1&zoom=1&source=gbs_api"
+
+def make_image(width: int = 1000, height: int = 1500) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), (180, 40, 40)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+class StandInUpstream:
+    # Local replacement for the Google Books image server
+    def __init__(self):
+        self.image = make_image()
+        self.requests = []
+        self.status = 200
+        self.delay = 0.0
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                upstream.requests.append(self.path)
+                time.sleep(upstream.delay)
+                if upstream.status != 200:
+                    self.send_error(upstream.status)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(upstream.image)))
+                self.end_headers()
+                self.wfile.write(upstream.image)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def upstream(tmp_path, monkeypatch):
+    server = StandInUpstream()
+    monkeypatch.setattr(covers, "COVER_UPSTREAM_BASE", server.base_url)
+    monkeypatch.setattr(covers, "COVER_CACHE_DIR", str(tmp_path / "cover_cache"))
+    monkeypatch.setattr(covers, "PLACEHOLDER_COVER", os.path.join(REPO_ROOT, "sample-cover.png"))
+    monkeypatch.setattr(covers, "_cover_cache", None)
+    yield server
+    server.close()
+
+def cached_files():
+    return sorted(os.listdir(covers.get_cover_cache().directory))
+
+def test_miss_fetches_upstream_and_stores_all_variants(upstream):
+    data, is_placeholder = covers.get_cover(1, THUMBNAIL, "medium")
+
+    assert not is_placeholder
+    assert len(upstream.requests) == 1
+    assert upstream.requests[0].startswith("/books/content?id=abc")
+    assert upstream.requests[0].endswith("&fife=w800")
+    assert cached_files() == ["1-large.jpg", "1-medium.jpg", "1-small.jpg"]
+    assert Image.open(BytesIO(data)).size == (400, 600)
+    for size, width in covers.COVER_SIZES.items():
+        path = os.path.join(covers.get_cover_cache().directory, f"1-{size}.jpg")
+        assert Image.open(path).width == width
+
+def test_hit_is_served_without_upstream_call(upstream):
+    covers.get_cover(1, THUMBNAIL, "small")
+    data, is_placeholder = covers.get_cover(1, THUMBNAIL, "large")
+
+    assert not is_placeholder
+    assert Image.open(BytesIO(data)).width == 800
+    assert len(upstream.requests) == 1
+    assert covers.cover_cache_stats()["hits"] == 1
+
+def test_concurrent_misses_share_one_upstream_fetch(upstream):
+    upstream.delay = 0.2
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(covers.get_cover(1, THUMBNAIL, "small")))
+        for _ in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(results) == 6
+    assert all(not is_placeholder for _, is_placeholder in results)
+    assert len(upstream.requests) == 1
+
+def test_least_recently_used_covers_are_evicted(upstream, monkeypatch):
+    covers.get_cover(1, THUMBNAIL, "small")
+    book_bytes = covers.cover_cache_stats()["bytes"]
+    monkeypatch.setattr(covers, "_cover_cache", None)
+    monkeypatch.setattr(covers, "COVER_CACHE_MAX_BYTES", 2 * book_bytes)
+
+    covers.get_cover(2, THUMBNAIL, "small")
+    # Touch every variant of book 1 so book 2 becomes the least recently used
+    for size in covers.COVER_SIZES:
+        covers.get_cover(1, THUMBNAIL, size)
+    covers.get_cover(3, THUMBNAIL, "small")
+
+    files = cached_files()
+    assert [f for f in files if f.startswith("2-")] == []
+    assert len([f for f in files if f.startswith("1-")]) == 3
+    assert len([f for f in files if f.startswith("3-")]) == 3
+    assert covers.cover_cache_stats()["evictions"] == 3
+
+def test_upstream_failure_serves_placeholder_with_short_max_age(upstream):
+    upstream.status = 500
+    response = covers.cover_response(1, THUMBNAIL, "small")
+
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "public, max-age=3600"
+    assert Image.open(BytesIO(response.body)).width <= covers.COVER_SIZES["small"]
+    assert not any(f.startswith("1-") for f in cached_files())
+
+    upstream.status = 200
+    response = covers.cover_response(1, THUMBNAIL, "small")
+    assert response.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+
+def test_matching_if_none_match_returns_304(upstream):
+    first = covers.cover_response(1, THUMBNAIL, "medium")
+    second = covers.cover_response(1, THUMBNAIL, "medium", if_none_match=first.headers["ETag"])
+
+    assert first.status_code == 200
+    assert second.status_code == 304
+    assert second.body == b""
+    assert second.headers["ETag"] == first.headers["ETag"]
+    assert len(upstream.requests) == 1
+
+def test_decode_failure_serves_placeholder(upstream, monkeypatch):
+    def bomb(image_bytes):
+        raise Image.DecompressionBombError("too many pixels")
+
+    # Render the placeholder before real decoding starts failing
+    placeholder = covers.placeholder_cover("small")
+    monkeypatch.setattr(covers, "render_variants", bomb)
+    response = covers.cover_response(1, THUMBNAIL, "small")
+
+    assert response.status_code == 200
+    assert response.body == placeholder
+    assert response.headers["Cache-Control"] == "public, max-age=3600"
+
+def test_prefetch_counts_failures_and_continues(upstream, monkeypatch, capsys):
+    def flaky_fetch(thumbnail):
+        if "id=bad" in thumbnail:
+            raise ValueError("unexpected image mode")
+        return upstream.image
+
+    monkeypatch.setattr(covers, "fetch_cover", flaky_fetch)
+    books = pd.DataFrame({
+        "isbn13": [1, 2, 3],
+        "thumbnail": [THUMBNAIL, THUMBNAIL.replace("id=abc", "id=bad"), THUMBNAIL],
+    })
+    covers.prefetch(books, workers=2)
+
+    assert "Fetched 2, failed 1" in capsys.readouterr().out
+    assert [f for f in cached_files() if f.startswith("2-")] == []
+    assert len([f for f in cached_files() if f.startswith("3-")]) == 3
+
+def test_failed_write_leaves_no_temp_file(upstream, monkeypatch):
+    def failing_replace(src, dst):
+        raise OSError("disk full")
+
+    cache = covers.get_cover_cache()
+    monkeypatch.setattr(covers.os, "replace", failing_replace)
+
+    with pytest.raises(OSError):
+        cache.put(1, {"small": b"jpeg"})
+    assert cached_files() == []
+    assert cache.stats()["files"] == 0
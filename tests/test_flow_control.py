@@ -0,0 +1,217 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+from flow_control import AdmissionController, Overloaded, RateLimiter, SingleFlight, client_ip
+
+def test_single_flight_coalesces_concurrent_identical_calls():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def work(x):
+        calls.append(x)
+        release.wait(5)
+        return x * 2
+
+    async def scenario():
+        waiters = [asyncio.ensure_future(flight.run("key", work, 21)) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*waiters)
+
+    assert asyncio.run(scenario()) == [42] * 5
+    assert calls == [21]
+    assert flight.stats() == {"in_flight": 0, "executed": 1, "coalesced": 4}
+
+def test_single_flight_propagates_error_to_every_waiter():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def work():
+        release.wait(5)
+        raise ValueError("boom")
+
+    async def scenario():
+        waiters = [asyncio.ensure_future(flight.run("key", work)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*waiters, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert len(results) == 3
+    assert all(isinstance(r, ValueError) and str(r) == "boom" for r in results)
+    assert "key" not in flight
+
+def test_single_flight_cancelled_waiter_does_not_cancel_shared_work():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def work():
+        release.wait(5)
+        return "done"
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.run("key", work))
+        second = asyncio.ensure_future(flight.run("key", work))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        await asyncio.sleep(0.05)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "done"
+    assert flight.stats()["executed"] == 1
+
+def test_rate_limiter_allows_burst_then_limits():
+    limiter = RateLimiter(rate_per_minute=60, burst=3)
+    assert [limiter.acquire("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("a") > 0
+    assert limiter.acquire("b") == 0.0
+    assert limiter.stats() == {"clients": 2, "limited": 1}
+
+def test_rate_limiter_is_disabled_by_non_positive_rate():
+    limiter = RateLimiter(rate_per_minute=0, burst=1)
+    assert [limiter.acquire("a") for _ in range(5)] == [0.0] * 5
+
+def test_client_ip_uses_trusted_forwarded_hop():
+    assert client_ip("10.0.0.1", "6.6.6.6, 203.0.113.7", trusted_hops=1) == "203.0.113.7"
+    assert client_ip("10.0.0.1", "6.6.6.6, 203.0.113.7", trusted_hops=0) == "10.0.0.1"
+    assert client_ip("10.0.0.1", None, trusted_hops=1) == "10.0.0.1"
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+def test_admission_admits_interactive_before_earlier_batch():
+    admission = AdmissionController(slots=1, max_queue=8, deadline=5, initial_service_time=0.01)
+    release = threading.Event()
+    order = []
+
+    def work(name):
+        if name == "running":
+            release.wait(5)
+        order.append(name)
+
+    threads = []
+    for priority, name in [(0, "running"), (1, "batch-1"), (1, "batch-2"), (0, "interactive")]:
+        thread = threading.Thread(target=admission.run, args=(priority, work, name))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: admission.stats()["active"] + admission.stats()["queue_depth"] == len(threads))
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ["running", "interactive", "batch-1", "batch-2"]
+    assert admission.stats()["admitted"] == 4
+
+def test_admission_sheds_on_deadline_and_removes_queue_entry():
+    admission = AdmissionController(slots=1, max_queue=8, deadline=0.1, initial_service_time=0.01)
+    release = threading.Event()
+    holder = threading.Thread(target=admission.run, args=(0, release.wait, 5))
+    holder.start()
+    wait_until(lambda: admission.stats()["active"] == 1)
+
+    with pytest.raises(Overloaded):
+        admission.run(0, lambda: None)
+    stats = admission.stats()
+    assert stats["shed"] == 1
+    assert stats["queue_depth"] == 0
+
+    release.set()
+    holder.join(5)
+    assert admission.run(0, lambda: "ok") == "ok"
+
+def test_admission_sheds_early_when_queue_is_full():
+    admission = AdmissionController(slots=1, max_queue=1, deadline=5, initial_service_time=0.01)
+    release = threading.Event()
+    threads = [threading.Thread(target=admission.run, args=(0, release.wait, 5)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: admission.stats()["queue_depth"] == 1)
+
+    with pytest.raises(Overloaded):
+        admission.enqueue(0)
+    assert admission.stats()["shed"] == 1
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+def test_retrieval_through_single_flight_waits_in_priority_queue_not_executor():
+    # Mirrors get_recommendations: take a queue place on the loop, then run on a sized executor
+    admission = AdmissionController(slots=1, max_queue=2, deadline=5, initial_service_time=0.01)
+    executor = ThreadPoolExecutor(max_workers=1 + 2)
+    flight = SingleFlight(executor=executor)
+    release = threading.Event()
+    order = []
+
+    def work(name):
+        release.wait(5)
+        order.append(name)
+        return name
+
+    async def submit(name, priority):
+        ticket = admission.enqueue(priority)
+        return await flight.run(name, admission.run_ticket, ticket, work, name)
+
+    async def scenario():
+        running = asyncio.ensure_future(submit("running", 1))
+        await asyncio.sleep(0.05)
+        queued = [asyncio.ensure_future(submit(f"batch-{i}", 1)) for i in range(2)]
+        await asyncio.sleep(0.05)
+        assert admission.stats()["queue_depth"] == 2
+        with pytest.raises(Overloaded):
+            await submit("overflow", 1)
+        release.set()
+        return await asyncio.gather(running, *queued)
+
+    try:
+        assert asyncio.run(scenario()) == ["running", "batch-0", "batch-1"]
+    finally:
+        executor.shutdown(wait=True)
+    assert order == ["running", "batch-0", "batch-1"]
+    assert admission.stats()["shed"] == 1
+
+def test_full_queue_displaces_newest_batch_entry_for_interactive():
+    admission = AdmissionController(slots=1, max_queue=2, deadline=5, initial_service_time=0.01)
+    release = threading.Event()
+    order, shed = [], []
+
+    def work(name):
+        if name == "running":
+            release.wait(5)
+        order.append(name)
+
+    def submit(priority, name):
+        try:
+            admission.run(priority, work, name)
+        except Overloaded:
+            shed.append(name)
+
+    threads = []
+    for priority, name in [(1, "running"), (1, "batch-0"), (1, "batch-1")]:
+        thread = threading.Thread(target=submit, args=(priority, name))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: admission.stats()["active"] + admission.stats()["queue_depth"] == len(threads))
+
+    with pytest.raises(Overloaded):
+        admission.enqueue(1)
+    interactive = threading.Thread(target=submit, args=(0, "interactive"))
+    interactive.start()
+    threads.append(interactive)
+    wait_until(lambda: shed == ["batch-1"])
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ["running", "interactive", "batch-0"]
+    assert admission.stats()["shed"] == 2
+    assert admission.stats()["queue_depth"] == 0
@@ -0,0 +1,64 @@
+import base64
+import time
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from pagination import CandidateCache, decode_cursor, encode_cursor, load_cursor, paginate
+
+ISBNS = np.arange(100, 110, dtype=np.int64)
+SCORES = np.linspace(0.1, 1.0, 10).astype(np.float32)
+
+def test_pages_follow_cursor_until_last_page():
+    cache = CandidateCache(ttl=60, max_entries=8)
+    page, cursor = paginate(cache, ISBNS, SCORES, "Happy", None, 0, 4)
+    assert page.tolist() == [100, 101, 102, 103]
+
+    isbns, scores, tone, token, offset = load_cursor(cache, cursor)
+    assert tone == "Happy" and offset == 4
+    page, cursor = paginate(cache, isbns, scores, tone, token, offset, 4)
+    assert page.tolist() == [104, 105, 106, 107]
+
+    page, cursor = paginate(cache, *load_cursor(cache, cursor), 4)
+    assert page.tolist() == [108, 109]
+    assert cursor is None
+    assert cache.stats() == {"entries": 1}
+
+def test_single_page_is_not_cached():
+    cache = CandidateCache(ttl=60, max_entries=8)
+    page, cursor = paginate(cache, ISBNS, SCORES, None, None, 0, 10)
+    assert len(page) == 10
+    assert cursor is None
+    assert cache.stats() == {"entries": 0}
+
+def test_expired_cursor_returns_410():
+    cache = CandidateCache(ttl=0.01, max_entries=8)
+    _, cursor = paginate(cache, ISBNS, SCORES, None, None, 0, 4)
+    time.sleep(0.02)
+    with pytest.raises(HTTPException) as excinfo:
+        load_cursor(cache, cursor)
+    assert excinfo.value.status_code == 410
+
+def test_size_cap_evicts_oldest_ranking():
+    cache = CandidateCache(ttl=60, max_entries=2)
+    cursors = [paginate(cache, ISBNS, SCORES, None, None, 0, 4)[1] for _ in range(3)]
+    assert cache.stats() == {"entries": 2}
+    with pytest.raises(HTTPException) as excinfo:
+        load_cursor(cache, cursors[0])
+    assert excinfo.value.status_code == 410
+    assert load_cursor(cache, cursors[2])[4] == 4
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"no-offset").decode(),
+    base64.urlsafe_b64encode(b"token:abc").decode(),
+    base64.urlsafe_b64encode(b"\xff\xfe:1").decode(),
+    encode_cursor("token", -4),
+])
+def test_bad_cursor_returns_400(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        decode_cursor(cursor)
+    assert excinfo.value.status_code == 400
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor("abc:def", 32)) == ("abc:def", 32)